@@ -1,8 +1,13 @@
 import asyncio
+import functools
 import logging
 import os
 import sys
 import re
+import sqlite3
+import time
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -23,56 +28,70 @@ ROOT_DIR = Path(__file__).resolve().parent.parent
 sys.path.append(str(ROOT_DIR))
 load_dotenv(ROOT_DIR / "config.env")
 
-from core import service, storage  # noqa: E402
-from core.storage import get_conn  # noqa: E402
+from core import parser, service, storage  # noqa: E402
 
 # === Конфиг ===
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
-_daily_digest_raw = os.getenv("DAILY_DIGEST_TIME", "").strip()
-if _daily_digest_raw:
-    try:
-        _h, _m = map(int, _daily_digest_raw.split(":"))
-        DAILY_DIGEST_ENABLED = True
-        DAILY_DIGEST_HOUR = _h
-        DAILY_DIGEST_MINUTE = _m
-    except ValueError:
-        DAILY_DIGEST_ENABLED = False
-        DAILY_DIGEST_HOUR = DAILY_DIGEST_MINUTE = None
-else:
-    DAILY_DIGEST_ENABLED = False
-    DAILY_DIGEST_HOUR = DAILY_DIGEST_MINUTE = None
-
-_event_rem_raw = (
-    os.getenv("EVENT_REMIND_BEFORE_MINUTES", "").strip()
-    or os.getenv("REMIND_BEFORE_MINUTES", "").strip()
-)
-EVENT_REMIND_BEFORE_MINUTES = int(_event_rem_raw) if _event_rem_raw else None
+@dataclass(frozen=True, slots=True)
+class BotConfig:
+    bot_token: str | None
+    log_level: str
+    daily_digest_enabled: bool
+    daily_digest_hour: int | None
+    daily_digest_minute: int | None
+    event_remind_before_minutes: int | None
+    task_remind_before_minutes: int | None
+
+
+@functools.cache
+def get_config() -> BotConfig:
+    """
+    Читаем переменные окружения один раз за процесс.
+    """
+    digest_raw = os.getenv("DAILY_DIGEST_TIME", "").strip()
+    digest_hour = digest_minute = None
+    if digest_raw:
+        try:
+            digest_hour, digest_minute = map(int, digest_raw.split(":"))
+        except ValueError:
+            digest_hour = digest_minute = None
+
+    event_rem_raw = (
+        os.getenv("EVENT_REMIND_BEFORE_MINUTES", "").strip()
+        or os.getenv("REMIND_BEFORE_MINUTES", "").strip()
+    )
+    task_rem_raw = os.getenv("TASK_REMIND_BEFORE_MINUTES", "").strip()
+
+    return BotConfig(
+        bot_token=os.getenv("BOT_TOKEN"),
+        log_level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        daily_digest_enabled=digest_hour is not None,
+        daily_digest_hour=digest_hour,
+        daily_digest_minute=digest_minute,
+        event_remind_before_minutes=int(event_rem_raw) if event_rem_raw else None,
+        task_remind_before_minutes=int(task_rem_raw) if task_rem_raw else None,
+    )
 
-_task_rem_raw = os.getenv("TASK_REMIND_BEFORE_MINUTES", "").strip()
-TASK_REMIND_BEFORE_MINUTES = int(_task_rem_raw) if _task_rem_raw else None
 
-if not BOT_TOKEN:
+if not get_config().bot_token:
     raise RuntimeError("BOT_TOKEN не задан (проверь config.env в корне проекта)")
 
-logging.basicConfig(level=LOG_LEVEL)
+logging.basicConfig(level=get_config().log_level)
 logger = logging.getLogger(__name__)
 
 bot = Bot(
-    BOT_TOKEN,
+    get_config().bot_token,
     default=DefaultBotProperties(parse_mode="HTML"),
 )
 dp = Dispatcher()
 
 # === Регекс и константы ===
 
-TIME_REGEX = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")  # чистое время
-TIME_ANY_REGEX = re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")
-DATE_REGEX = re.compile(
-    r"\b(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?\b"
-)
+# Время и дата — те же скомпилированные шаблоны, что в парсере.
+# "Чистое" время (только HH:MM) проверяем через TIME_ANY_REGEX.fullmatch.
+TIME_ANY_REGEX = parser.TIME_REGEX
+DATE_REGEX = parser.DATE_REGEX
 
 WEEKDAY_IN_TEXT_PATTERN = re.compile(
     r"\bво?\s+("
@@ -93,29 +112,87 @@ TIME_WORDS_EVENT = (
     "воскресенье",
     "пн", "вт", "ср", "чт", "пт", "сб", "вс",
 )
+TIME_WORDS_EVENT_RE = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, TIME_WORDS_EVENT)) + r")\b",
+    re.IGNORECASE,
+)
+
+# время/дата (и слова-признаки события) одним проходом вместо двух-трёх search
+_DATE_OR_TIME_RE = re.compile(TIME_ANY_REGEX.pattern + "|" + DATE_REGEX.pattern)
+_EVENT_TIME_PHRASE_RE = re.compile(
+    _DATE_OR_TIME_RE.pattern + "|" + TIME_WORDS_EVENT_RE.pattern,
+    re.IGNORECASE,
+)
+
+# дни недели + даты + время одним проходом (для чистки заголовков)
+_STRIP_ALL = re.compile(
+    WEEKDAY_IN_TEXT_PATTERN.pattern + "|" + DATE_REGEX.pattern + "|" + TIME_ANY_REGEX.pattern,
+    re.IGNORECASE,
+)
+
+
+class _TTLCache:
+    """
+    Словарь key -> (stamp, value), где ключ живёт ttl секунд с последней записи.
+    Просроченные ключи не видны через in / get и вычищаются prune().
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data: dict = {}
+
+    def _live(self, key):
+        # одна выборка: запись или None, просроченную сразу выбрасываем
+        entry = self._data.get(key)
+        if entry is not None and time.monotonic() - entry[0] >= self.ttl:
+            self._data.pop(key, None)
+            return None
+        return entry
+
+    def __contains__(self, key) -> bool:
+        return self._live(key) is not None
+
+    def get(self, key, default=None):
+        entry = self._live(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic(), value)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def drop_where(self, pred) -> None:
+        for key in [k for k in self._data if pred(k)]:
+            del self._data[key]
+
+    def prune(self) -> None:
+        now = time.monotonic()
+        self.drop_where(lambda k: now - self._data[k][0] >= self.ttl)
+
 
 # pending конфликты: user_id -> {day:str, title:str, duration:int}
-PENDING_CONFLICTS: dict[str, dict] = {}
+# Пользователь может так и не ответить — через час забываем.
+PENDING_CONFLICTS = _TTLCache(ttl=3600)
+
+# кэш текста плана на день для сообщений о конфликте: (user_id, day_iso) -> text
+_PLAN_CACHE = _TTLCache(ttl=30)
+
+# кэш сырых строк из БД для /today, /week, /month подряд:
+# (user_id, start_iso, end_iso) -> (events, tasks)
+_ROWS_CACHE = _TTLCache(ttl=10)
 
 # === Хелперы ===
 
 
 def has_explicit_date_or_time(text: str) -> bool:
-    t = text.lower()
-    if TIME_ANY_REGEX.search(t):
-        return True
-    if DATE_REGEX.search(t):
-        return True
-    return False
+    # оба регекса только про цифры — регистр не важен, .lower() не нужен
+    return _DATE_OR_TIME_RE.search(text) is not None
 
 
 def has_event_time_phrase(text: str) -> bool:
-    t = text.lower()
-    if has_explicit_date_or_time(t):
-        return True
-    if any(w in t for w in TIME_WORDS_EVENT):
-        return True
-    return False
+    return _EVENT_TIME_PHRASE_RE.search(text) is not None
 
 
 def format_date_ru(dt: datetime) -> str:
@@ -126,12 +203,24 @@ def format_datetime_ru(dt: datetime) -> str:
     return dt.strftime("%d.%m.%Y %H:%M")
 
 
+# время в хранимых ISO-строках (срез [11:19]), которое парсер ставит по умолчанию:
+# событию без времени — 10:00, задаче без времени — конец дня
+DEFAULT_MORNING_ISO_TIME = "10:00:00"
+END_OF_DAY_ISO_TIME = "23:59:00"
+
+
 def is_end_of_day(dt: datetime) -> bool:
     return dt.hour == 23 and dt.minute == 59 and dt.second == 0
 
 
-def is_default_morning(dt: datetime) -> bool:
-    return dt.hour == 10 and dt.minute == 0 and dt.second == 0
+def _iso_is_end_of_day(iso: str) -> bool:
+    """is_end_of_day по строке YYYY-MM-DDTHH:MM:SS, без сборки datetime."""
+    return iso[11:19] == END_OF_DAY_ISO_TIME
+
+
+def _iso_is_default_morning(iso: str) -> bool:
+    """Слот 10:00, который парсер ставит событию без явного времени."""
+    return iso[11:19] == DEFAULT_MORNING_ISO_TIME
 
 
 def strip_weekday_phrase(text: str, default_label: str = "Задача") -> str:
@@ -139,43 +228,29 @@ def strip_weekday_phrase(text: str, default_label: str = "Задача") -> str:
     return clean or default_label
 
 
-def clean_for_reschedule(text: str) -> str:
+def _clean_title(text: str) -> str:
     """
-    Очищаем заголовок для повторного планирования:
-    убираем дни недели, даты, время и висящее 'в'.
+    Убираем из заголовка дни недели, даты, время и висящее 'в'.
     """
-    b = (text or "").strip()
-    b = WEEKDAY_IN_TEXT_PATTERN.sub("", b)
-    b = DATE_REGEX.sub("", b)
-    b = TIME_ANY_REGEX.sub("", b)
-    b = re.sub(r"\bв$", "", b)
-    b = b.strip(" ,.-")
-    return b or "Без названия"
+    b = _STRIP_ALL.sub("", text).strip(" ,.-")
+    # b уже обрезан — повторный strip нужен только после удаления 'в'
+    if parser._has_trailing_v(b):
+        b = b[:-1].strip(" ,.-")
+    return b
 
 
-def format_timed_line(base: str, start_dt: datetime | None, end_dt: datetime | None) -> str:
+def clean_for_reschedule(text: str) -> str:
     """
-    Слот:
-      📆 16:00-18:00 текст
-    без дат и дней недели внутри текста.
+    Очищаем заголовок для повторного планирования:
+    убираем дни недели, даты, время и висящее 'в'.
     """
-    b = (base or "").strip() or "Без названия"
+    return _clean_title((text or "").strip()) or "Без названия"
 
-    b = WEEKDAY_IN_TEXT_PATTERN.sub("", b).strip(" ,.-")
-    b = DATE_REGEX.sub("", b).strip(" ,.-")
-    b = TIME_ANY_REGEX.sub("", b).strip(" ,.-")
-    b = re.sub(r"\bв$", "", b).strip(" ,.-")
-    if not b:
-        b = "Без названия"
 
-    if not start_dt:
+def _slot_line(base: str, label: str | None) -> str:
+    b = _clean_title((base or "").strip()) or "Без названия"
+    if not label:
         return f"📆 {b}"
-
-    if end_dt and end_dt > start_dt:
-        label = f"{start_dt.strftime('%H:%M')}-{end_dt.strftime('%H:%M')}"
-    else:
-        label = start_dt.strftime("%H:%M")
-
     return f"📆 <b>{label}</b> {b}"
 
 
@@ -198,109 +273,130 @@ def format_task_reminder(title: str, due_dt: datetime) -> str:
 # === Разделение по дню ===
 
 
+def _iso_minutes(iso: str) -> int:
+    """Минуты от начала дня по строке YYYY-MM-DDTHH:MM:SS."""
+    return int(iso[11:13]) * 60 + int(iso[14:16])
+
+
 def split_items_for_day(events, tasks, day_start: datetime, day_end: datetime):
     """
     events: (title, start_at, end_at)
     tasks: (title, due_at)
+
+    Время берём срезами ISO-строк (YYYY-MM-DDTHH:MM:SS), datetime не собираем.
     """
-    timed: list[str] = []
+    timed: list[tuple[int, str]] = []  # (минуты от начала дня, строка)
     day_tasks: list[str] = []
 
+    # ISO-строки сравниваются лексикографически, так что границы дня
+    # проверяем прямо по строке.
+    ds_iso = day_start.isoformat()
+    de_iso = day_end.isoformat()
+
     # События
     for title, start_at, end_at in events:
-        if not start_at:
+        if not start_at or not (ds_iso <= start_at < de_iso):
             continue
         try:
-            sdt = datetime.fromisoformat(start_at)
-            edt = datetime.fromisoformat(end_at) if end_at else None
-        except Exception:
-            continue
-        if not (day_start <= sdt < day_end):
+            minutes = _iso_minutes(start_at)
+        except ValueError:
             continue
 
         base = (title or "").strip() or "Без названия"
 
-        if is_default_morning(sdt) and not has_explicit_date_or_time(base):
+        # слот по умолчанию без явного времени в тексте
+        if _iso_is_default_morning(start_at) and not has_explicit_date_or_time(base):
             day_tasks.append(strip_weekday_phrase(base, default_label="Запись"))
-        else:
-            timed.append(format_timed_line(base, sdt, edt))
+            continue
+
+        label = start_at[11:16]
+        if end_at and end_at > start_at:
+            label = f"{label}-{end_at[11:16]}"
+        timed.append((minutes, _slot_line(base, label)))
 
     # Задачи
     for title, due_at in tasks:
         base = (title or "").strip() or "Задача"
-        if not due_at:
+        if not due_at or not (ds_iso <= due_at < de_iso):
             continue
         try:
-            dt = datetime.fromisoformat(due_at)
-        except Exception:
-            continue
-        if not (day_start <= dt < day_end):
+            minutes = _iso_minutes(due_at)
+        except ValueError:
             continue
 
-        if not is_end_of_day(dt):
-            timed.append(format_timed_line(base, dt, None))
+        # не конец дня — задача к конкретному времени
+        if not _iso_is_end_of_day(due_at):
+            timed.append((minutes, _slot_line(base, due_at[11:16])))
             continue
 
         if TIME_ANY_REGEX.search(base):
-            timed.append(format_timed_line(base, None, None))
+            timed.append((9999, _slot_line(base, None)))
         else:
             day_tasks.append(strip_weekday_phrase(base, default_label="Задача"))
 
-    def extract_time_prefix(s: str):
-        m = TIME_ANY_REGEX.search(s)
-        if m:
-            try:
-                h = int(m.group(1))
-                mn = int(m.group(2))
-                return h * 60 + mn
-            except Exception:
-                return 9999
-        return 9999
-
-    timed_sorted = sorted(timed, key=extract_time_prefix)
+    timed_sorted = [line for _, line in sorted(timed, key=lambda x: x[0])]
     return timed_sorted, day_tasks
 
 
 # === Сводки ===
 
 
-def build_day_plan_text(user_id: str, day: datetime.date) -> str:
-    day_start = datetime(day.year, day.month, day.day, 0, 0, 0)
-    day_end = day_start + timedelta(days=1)
+def _fetch_items(user_id: str, start: datetime, end: datetime):
+    """
+    События и активные задачи пользователя в [start, end) одним запросом.
+    events: (title, start_at, end_at, d)
+    tasks: (title, due_at, d)
+    d — дата в виде YYYY-MM-DD.
+    Без ORDER BY: внутри дня порядок всё равно задаёт split_items_for_day.
+    """
+    start_iso = start.isoformat()
+    end_iso = end.isoformat()
 
-    conn = get_conn()
-    cur = conn.cursor()
+    key = (user_id, start_iso, end_iso)
+    cached = _ROWS_CACHE.get(key)
+    if cached is not None:
+        return cached
 
+    cur = storage.get_conn().cursor()
     cur.execute(
         """
-        SELECT title, start_at, end_at FROM items
+        SELECT 'e' AS k, title, start_at, end_at, substr(start_at, 1, 10) AS d FROM items
         WHERE user_id = ?
           AND type = 'event'
           AND start_at IS NOT NULL
           AND start_at >= ?
           AND start_at < ?
-        ORDER BY start_at
-        """,
-        (user_id, day_start.isoformat(), day_end.isoformat()),
-    )
-    events = cur.fetchall()
-
-    cur.execute(
-        """
-        SELECT title, due_at FROM items
+        UNION ALL
+        SELECT 't', title, due_at, NULL, substr(due_at, 1, 10) FROM items
         WHERE user_id = ?
           AND type = 'task'
           AND status = 'active'
           AND due_at IS NOT NULL
           AND due_at >= ?
           AND due_at < ?
-        ORDER BY due_at
         """,
-        (user_id, day_start.isoformat(), day_end.isoformat()),
+        (user_id, start_iso, end_iso, user_id, start_iso, end_iso),
     )
-    tasks = cur.fetchall()
 
-    conn.close()
+    events = []
+    tasks = []
+    for k, title, at, end_at, d in cur.fetchall():
+        if k == "e":
+            events.append((title, at, end_at, d))
+        else:
+            tasks.append((title, at, d))
+
+    _ROWS_CACHE.set(key, (events, tasks))
+    return events, tasks
+
+
+def build_day_plan_text(user_id: str, day: datetime.date) -> str:
+    day_start = datetime(day.year, day.month, day.day, 0, 0, 0)
+    day_end = day_start + timedelta(days=1)
+
+    events, tasks = _fetch_items(user_id, day_start, day_end)
+    events = [row[:3] for row in events]
+    tasks = [row[:2] for row in tasks]
 
     timed, day_tasks = split_items_for_day(events, tasks, day_start, day_end)
 
@@ -317,6 +413,21 @@ def build_day_plan_text(user_id: str, day: datetime.date) -> str:
     return "\n".join(lines)
 
 
+def _cached_day_plan(user_id: str, day: datetime.date) -> str:
+    key = (user_id, day.isoformat())
+    text = _PLAN_CACHE.get(key)
+    if text is None:
+        text = build_day_plan_text(user_id, day)
+        _PLAN_CACHE.set(key, text)
+    return text
+
+
+def _invalidate_user(user_id: str) -> None:
+    """Сбрасываем закэшированные планы и строки пользователя после изменения его записей."""
+    _PLAN_CACHE.drop_where(lambda k: k[0] == user_id)
+    _ROWS_CACHE.drop_where(lambda k: k[0] == user_id)
+
+
 def build_today_summary_text(user_id: str) -> str | None:
     now = datetime.now()
     txt = build_day_plan_text(user_id, now.date())
@@ -334,39 +445,7 @@ def get_period_items(user_id: str, days: int):
     start = datetime(now.year, now.month, now.day, 0, 0, 0)
     end = start + timedelta(days=days)
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        SELECT title, start_at, end_at FROM items
-        WHERE user_id = ?
-          AND type = 'event'
-          AND start_at IS NOT NULL
-          AND start_at >= ?
-          AND start_at < ?
-        ORDER BY start_at
-        """,
-        (user_id, start.isoformat(), end.isoformat()),
-    )
-    events = cur.fetchall()
-
-    cur.execute(
-        """
-        SELECT title, due_at FROM items
-        WHERE user_id = ?
-          AND type = 'task'
-          AND status = 'active'
-          AND due_at IS NOT NULL
-          AND due_at >= ?
-          AND due_at < ?
-        ORDER BY due_at
-        """,
-        (user_id, start.isoformat(), end.isoformat()),
-    )
-    tasks = cur.fetchall()
-
-    conn.close()
+    events, tasks = _fetch_items(user_id, start, end)
     return events, tasks, start
 
 
@@ -376,35 +455,43 @@ def build_period_schedule_text(user_id: str, days: int, header: str) -> str:
     if not events and not tasks:
         return f"{header}\n\nНет запланированных дел."
 
-    schedule: dict[str, dict[str, list[str]]] = {}
+    # Раскладываем строки по дням за один проход: ключ — дата из SQL (YYYY-MM-DD).
+    events_by_day: dict[str, list] = defaultdict(list)
+    for title, start_at, end_at, d in events:
+        events_by_day[d].append((title, start_at, end_at))
+
+    tasks_by_day: dict[str, list] = defaultdict(list)
+    for title, due_at, d in tasks:
+        tasks_by_day[d].append((title, due_at))
+
+    # ключ — ISO-дата (YYYY-MM-DD); дни добавляются по порядку offset,
+    # так что dict уже хронологический и пересортировка не нужна
+    schedule: dict[str, dict] = {}
 
     for offset in range(days):
         day_start = start + timedelta(days=offset)
         day_end = day_start + timedelta(days=1)
-        day_key = format_date_ru(day_start)
+        iso_day = day_start.date().isoformat()
 
-        day_events = [
-            (t, s, e)
-            for (t, s, e) in events
-            if s and day_start <= datetime.fromisoformat(s) < day_end
-        ]
-        day_tasks = [
-            (t, d)
-            for (t, d) in tasks
-            if d and day_start <= datetime.fromisoformat(d) < day_end
-        ]
+        day_events = events_by_day.get(iso_day, [])
+        day_tasks = tasks_by_day.get(iso_day, [])
+        if not day_events and not day_tasks:
+            continue
 
         timed, day_only = split_items_for_day(day_events, day_tasks, day_start, day_end)
         if timed or day_only:
-            schedule[day_key] = {"timed": timed, "day_tasks": day_only}
+            schedule[iso_day] = {
+                "label": format_date_ru(day_start),
+                "timed": timed,
+                "day_tasks": day_only,
+            }
 
     if not schedule:
         return f"{header}\n\nНет запланированных дел."
 
     lines = [header]
-    for day in sorted(schedule.keys(), key=lambda d: datetime.strptime(d, "%d.%m.%Y")):
-        block = schedule[day]
-        lines.append(f"\n<b>{day}</b>:")
+    for block in schedule.values():
+        lines.append(f"\n<b>{block['label']}</b>:")
         for item in block["timed"]:
             lines.append(f"  {item}")
         if block["day_tasks"]:
@@ -464,7 +551,7 @@ def build_conflict_message(user_id: str, payload: str):
     except Exception:
         pass
 
-    plan_text = build_day_plan_text(user_id, day)
+    plan_text = _cached_day_plan(user_id, day)
 
     kb = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -491,6 +578,18 @@ def build_conflict_message(user_id: str, payload: str):
     return text, kb, pending
 
 
+# === Обёртка над service ===
+
+
+def _handle_input(user_id: str, text: str):
+    reply, item = service.handle_input(user_id, text)
+    if item is not None:
+        _invalidate_user(user_id)
+        # новая запись может напоминать раньше, чем reminder_loop собирался проснуться
+        _REMINDER_WAKEUP.set()
+    return reply, item
+
+
 # === Команды ===
 
 
@@ -543,29 +642,25 @@ async def cmd_tasks(message: Message):
 
     for _item_id, title, due_at in rows:
         base = (title or "").strip() or "Задача"
-        lower = base.lower()
 
         if not due_at:
             filtered.append((base, None))
             continue
 
+        # считаем один раз: дальше оба признака нужны в нескольких ветках
+        has_do = "до " in base.lower()
+        has_time = has_do and TIME_ANY_REGEX.search(base) is not None
+
         try:
             dt = datetime.fromisoformat(due_at)
         except Exception:
-            if "до " in lower and not TIME_ANY_REGEX.search(base):
+            if has_do and not has_time:
                 filtered.append((base, None))
             continue
 
-        if not is_end_of_day(dt):
-            continue
-
-        if TIME_ANY_REGEX.search(base):
-            continue
-
-        if WEEKDAY_IN_TEXT_PATTERN.search(base) and "до " not in lower:
-            continue
-
-        if "до " in lower:
+        # Без "до ..." или с точным временем задача уже стоит в /week и /month.
+        # (Проверка дня недели тут не нужна: без "до " задача не попадает в список.)
+        if has_do and not has_time and is_end_of_day(dt):
             filtered.append((base, dt))
 
     if not filtered:
@@ -573,12 +668,10 @@ async def cmd_tasks(message: Message):
         return
 
     lines = ["Активные задачи (без точного времени):"]
-    for idx, (base, due) in enumerate(filtered, start=1):
-        if due is None:
-            lines.append(f"{idx}. {base}")
-        else:
-            due_str = format_date_ru(due)
-            lines.append(f"{idx}. до <b>{due_str}</b> {base}")
+    lines.extend(
+        f"{idx}. {base}" if due is None else f"{idx}. до <b>{format_date_ru(due)}</b> {base}"
+        for idx, (base, due) in enumerate(filtered, start=1)
+    )
 
     await message.answer("\n".join(lines))
 
@@ -649,14 +742,14 @@ async def handle_text(message: Message):
     text = message.text.strip()
 
     # режим разрешения конфликта
-    if user_id in PENDING_CONFLICTS:
-        pending = PENDING_CONFLICTS[user_id]
+    pending = PENDING_CONFLICTS.get(user_id)
+    if pending is not None:
         title = pending["title"]
         duration_min = pending["duration"]
         day_iso = pending["day"]
 
         # 1) Только время HH:MM -> тот же день
-        if TIME_REGEX.fullmatch(text):
+        if TIME_ANY_REGEX.fullmatch(text):
             h, m = map(int, text.split(":"))
             try:
                 day = datetime.fromisoformat(day_iso).date()
@@ -670,7 +763,7 @@ async def handle_text(message: Message):
                 synth = f"{title} {start_dt.strftime('%d.%m.%Y %H:%M')}"
 
             PENDING_CONFLICTS.pop(user_id, None)
-            reply, _item = service.handle_input(user_id, synth)
+            reply, _item = _handle_input(user_id, synth)
             await message.answer(reply)
             return
 
@@ -681,7 +774,7 @@ async def handle_text(message: Message):
             else:
                 synth = f"{title} {text}"
             PENDING_CONFLICTS.pop(user_id, None)
-            reply, _item = service.handle_input(user_id, synth)
+            reply, _item = _handle_input(user_id, synth)
             await message.answer(reply)
             return
 
@@ -699,10 +792,10 @@ async def handle_text(message: Message):
                     y = now.year
                 new_day = datetime(y, mo, d).date()
                 pending["day"] = new_day.isoformat()
-                PENDING_CONFLICTS[user_id] = pending
+                PENDING_CONFLICTS.set(user_id, pending)
             except Exception:
                 PENDING_CONFLICTS.pop(user_id, None)
-                reply, _item = service.handle_input(user_id, text)
+                reply, _item = _handle_input(user_id, text)
                 await message.answer(reply)
                 return
 
@@ -713,17 +806,17 @@ async def handle_text(message: Message):
 
         # 4) Любой другой ввод -> выходим из режима и обрабатываем как новый запрос
         PENDING_CONFLICTS.pop(user_id, None)
-        reply, _item = service.handle_input(user_id, text)
+        reply, _item = _handle_input(user_id, text)
         await message.answer(reply)
         return
 
     # обычный режим
-    reply, _item = service.handle_input(user_id, text)
+    reply, _item = _handle_input(user_id, text)
 
     if reply.startswith("__CONFLICT__|"):
         text_out, kb, pending = build_conflict_message(user_id, reply)
         if pending:
-            PENDING_CONFLICTS[user_id] = pending
+            PENDING_CONFLICTS.set(user_id, pending)
         await message.answer(text_out, reply_markup=kb)
     else:
         await message.answer(reply)
@@ -731,109 +824,237 @@ async def handle_text(message: Message):
 
 # === Напоминания + дайджест ===
 
+# сколько сообщений Telegram отправляем одновременно
+REMINDER_SEND_CONCURRENCY = 20
+
+# границы сна reminder_loop между проверками, секунд
+REMINDER_MIN_SLEEP = 5
+REMINDER_MAX_SLEEP = 300
+
+# будит reminder_loop раньше срока (после добавления записи)
+_REMINDER_WAKEUP = asyncio.Event()
+
+# тексты запросов неизменны — sqlite держит их планы в кэше соединения
+SQL_DUE_EVENTS = """
+    SELECT id, user_id, title, start_at
+    FROM items
+    WHERE type = 'event'
+      AND status = 'active'
+      AND start_at IS NOT NULL
+      AND event_notified = 0
+      AND start_at >= ?
+      AND start_at <= ?
+"""
+
+SQL_DUE_TASKS = """
+    SELECT id, user_id, title, due_at
+    FROM items
+    WHERE type = 'task'
+      AND status = 'active'
+      AND due_at IS NOT NULL
+      AND due_notified = 0
+      AND due_at >= ?
+      AND due_at <= ?
+"""
+
+SQL_NEXT_EVENT = """
+    SELECT MIN(start_at) FROM items
+    WHERE type = 'event'
+      AND status = 'active'
+      AND event_notified = 0
+      AND start_at > ?
+"""
+
+SQL_NEXT_TASK = """
+    SELECT MIN(due_at) FROM items
+    WHERE type = 'task'
+      AND status = 'active'
+      AND due_notified = 0
+      AND due_at > ?
+"""
+
+
+async def _send_reminders(batch: list[tuple[int, str, str]], kind: str) -> list[int]:
+    """
+    batch: (item_id, user_id, text).
+    Шлём параллельно, не больше REMINDER_SEND_CONCURRENCY за раз.
+    Возвращаем id записей, напоминание по которым ушло.
+    """
+    sem = asyncio.Semaphore(REMINDER_SEND_CONCURRENCY)
+
+    async def _send(item_id: int, uid: str, text: str) -> int | None:
+        async with sem:
+            try:
+                await bot.send_message(int(uid), text)
+            except Exception as e:
+                logger.error("Ошибка отправки напоминания (%s): %s", kind, e)
+                return None
+            return item_id
+
+    results = await asyncio.gather(*(_send(*entry) for entry in batch))
+    return [item_id for item_id in results if item_id is not None]
+
+
+async def _send_digest(user_id: str, day, sem: asyncio.Semaphore) -> bool:
+    """
+    False — сводку не удалось собрать (ошибка БД и т.п.), её стоит повторить.
+    Ошибка отправки не повторяется: пользователь мог заблокировать бота.
+    """
+    try:
+        text = build_today_summary_text(user_id)
+    except Exception as e:
+        logger.error("Ошибка сборки утренней сводки для %s: %s", user_id, e)
+        return False
+    if not text:
+        return True
+    try:
+        async with sem:
+            await bot.send_message(int(user_id), text)
+        storage.mark_digest_sent(user_id, day)
+    except Exception as e:
+        logger.error(
+            "Ошибка отправки утренней сводки пользователю %s: %s",
+            user_id,
+            e,
+        )
+    return True
+
+
+def _seconds_until_next_check(cur, now: datetime, cfg: BotConfig) -> float:
+    """
+    Сколько спать до ближайшего дела: напоминания, окно которого ещё не началось,
+    или утренней сводки. Результат в [REMINDER_MIN_SLEEP, REMINDER_MAX_SLEEP].
+    """
+    candidates = [float(REMINDER_MAX_SLEEP)]
+
+    if cfg.event_remind_before_minutes is not None:
+        before = timedelta(minutes=cfg.event_remind_before_minutes)
+        cur.execute(SQL_NEXT_EVENT, ((now + before).isoformat(),))
+        (next_at,) = cur.fetchone()
+        if next_at:
+            remind_at = datetime.fromisoformat(next_at) - before
+            candidates.append((remind_at - now).total_seconds())
+
+    if cfg.task_remind_before_minutes is not None:
+        before = timedelta(minutes=cfg.task_remind_before_minutes)
+        cur.execute(SQL_NEXT_TASK, ((now + before).isoformat(),))
+        (next_at,) = cur.fetchone()
+        if next_at:
+            remind_at = datetime.fromisoformat(next_at) - before
+            candidates.append((remind_at - now).total_seconds())
+
+    if cfg.daily_digest_enabled:
+        digest_dt = now.replace(
+            hour=cfg.daily_digest_hour,
+            minute=cfg.daily_digest_minute,
+            second=0,
+            microsecond=0,
+        )
+        if digest_dt <= now:
+            digest_dt += timedelta(days=1)
+        candidates.append((digest_dt - now).total_seconds())
+
+    return max(REMINDER_MIN_SLEEP, min(candidates))
+
 
 async def reminder_loop():
-    sent_digest = {}
+    cfg = get_config()
+
+    # user_id, кому сводка за digest_day уже ушла; со сменой дня множество
+    # сбрасывается. Отправленные сегодня подтягиваем из БД (на случай рестарта)
+    digest_day = datetime.now().date()
+    sent_digest: set[str] = storage.get_digest_sent_user_ids(digest_day)
+    # рассылка сводки за digest_day уже прошла — get_all_user_ids до завтра не нужен
+    digest_done = False
 
     while True:
+        sleep_s = 60.0
+        _REMINDER_WAKEUP.clear()
         try:
             now = datetime.now()
+            for cache in (PENDING_CONFLICTS, _PLAN_CACHE, _ROWS_CACHE):
+                cache.prune()
+            if now.date() != digest_day:
+                digest_day = now.date()
+                sent_digest = set()
+                digest_done = False
 
             # утренний дайджест
-            if DAILY_DIGEST_ENABLED:
+            if cfg.daily_digest_enabled:
                 digest_dt = now.replace(
-                    hour=DAILY_DIGEST_HOUR,
-                    minute=DAILY_DIGEST_MINUTE,
+                    hour=cfg.daily_digest_hour,
+                    minute=cfg.daily_digest_minute,
                     second=0,
                     microsecond=0,
                 )
-                if now >= digest_dt:
-                    for user_id in storage.get_all_user_ids():
-                        key = (user_id, now.date())
-                        if key in sent_digest:
+                if now >= digest_dt and not digest_done:
+                    # отмечаем до отправки, чтобы следующий тик не отправил повторно
+                    sem = asyncio.Semaphore(REMINDER_SEND_CONCURRENCY)
+                    users = [uid for uid in storage.get_all_user_ids() if uid not in sent_digest]
+                    sent_digest.update(users)
+                    results = await asyncio.gather(
+                        *(_send_digest(uid, digest_day, sem) for uid in users),
+                        return_exceptions=True,
+                    )
+                    # чья сводка не собралась — снимаем отметку и повторим на следующем тике;
+                    # проход считаем завершённым только когда повторять некого
+                    retry = False
+                    for uid, res in zip(users, results):
+                        if res is True:
                             continue
-                        text = build_today_summary_text(user_id)
-                        if text:
-                            try:
-                                await bot.send_message(int(user_id), text)
-                            except Exception as e:
-                                logger.error(
-                                    "Ошибка отправки утренней сводки пользователю %s: %s",
-                                    user_id,
-                                    e,
-                                )
-                        sent_digest[key] = True
-
-            conn = get_conn()
-            cur = conn.cursor()
-
-            # события
-            if EVENT_REMIND_BEFORE_MINUTES is not None:
-                cur.execute(
-                    """
-                    SELECT id, user_id, title, start_at
-                    FROM items
-                    WHERE type = 'event'
-                      AND status = 'active'
-                      AND start_at IS NOT NULL
-                      AND event_notified = 0
-                    """
-                )
+                        if isinstance(res, BaseException):
+                            logger.error("Ошибка утренней сводки для %s: %s", uid, res)
+                        sent_digest.discard(uid)
+                        retry = True
+                    digest_done = not retry
+
+            cur = storage.get_conn().cursor()
+
+            now_iso = now.isoformat()
+
+            # события: окно [now, now + event_remind_before_minutes] отбирает SQL по индексу
+            if cfg.event_remind_before_minutes is not None:
+                window_end = (now + timedelta(minutes=cfg.event_remind_before_minutes)).isoformat()
+                cur.execute(SQL_DUE_EVENTS, (now_iso, window_end))
                 events = cur.fetchall()
+                to_send: list[tuple[int, str, str]] = []
                 for item_id, uid, title, start_at in events:
                     try:
                         start_dt = datetime.fromisoformat(start_at)
                     except Exception:
                         continue
-                    diff_min = (start_dt - now).total_seconds() / 60
-                    if 0 <= diff_min <= EVENT_REMIND_BEFORE_MINUTES:
-                        text = format_event_reminder(title, start_dt)
-                        try:
-                            await bot.send_message(int(uid), text)
-                        except Exception as e:
-                            logger.error("Ошибка отправки напоминания (событие): %s", e)
-                        cur.execute(
-                            "UPDATE items SET event_notified = 1 WHERE id = ?",
-                            (item_id,),
-                        )
+                    to_send.append((item_id, uid, format_event_reminder(title, start_dt)))
+                storage.mark_events_notified(await _send_reminders(to_send, "событие"))
 
             # задачи
-            if TASK_REMIND_BEFORE_MINUTES is not None:
-                cur.execute(
-                    """
-                    SELECT id, user_id, title, due_at
-                    FROM items
-                    WHERE type = 'task'
-                      AND status = 'active'
-                      AND due_at IS NOT NULL
-                      AND due_notified = 0
-                    """
-                )
+            if cfg.task_remind_before_minutes is not None:
+                window_end = (now + timedelta(minutes=cfg.task_remind_before_minutes)).isoformat()
+                cur.execute(SQL_DUE_TASKS, (now_iso, window_end))
                 tasks = cur.fetchall()
+                to_send = []
                 for item_id, uid, title, due_at in tasks:
                     try:
                         due_dt = datetime.fromisoformat(due_at)
                     except Exception:
                         continue
-                    diff_min = (due_dt - now).total_seconds() / 60
-                    if 0 <= diff_min <= TASK_REMIND_BEFORE_MINUTES:
-                        text = format_task_reminder(title, due_dt)
-                        try:
-                            await bot.send_message(int(uid), text)
-                        except Exception as e:
-                            logger.error("Ошибка отправки напоминания (задача): %s", e)
-                        cur.execute(
-                            "UPDATE items SET due_notified = 1 WHERE id = ?",
-                            (item_id,),
-                        )
-
-            conn.commit()
-            conn.close()
+                    to_send.append((item_id, uid, format_task_reminder(title, due_dt)))
+                storage.mark_tasks_notified(await _send_reminders(to_send, "задача"))
 
+            sleep_s = _seconds_until_next_check(cur, now, cfg)
+
+        except sqlite3.OperationalError as e:
+            # соединение могло испортиться (файл заблокирован/пересоздан) — переоткроем
+            logger.error("Ошибка БД в reminder_loop, переподключаемся: %s", e)
+            storage.reset_conn()
+            sleep_s = REMINDER_MIN_SLEEP
         except Exception as e:
             logger.error("Ошибка в reminder_loop: %s", e)
 
-        await asyncio.sleep(60)
+        # спим до ближайшего напоминания/сводки или до появления новой записи
+        try:
+            await asyncio.wait_for(_REMINDER_WAKEUP.wait(), timeout=sleep_s)
+        except asyncio.TimeoutError:
+            pass
 
 
 # === Точка входа ===
@@ -5,7 +5,7 @@ from typing import Optional, Literal
 ItemType = Literal["event", "task", "note"]
 
 
-@dataclass
+@dataclass(slots=True)
 class Item:
     user_id: str
     type: ItemType
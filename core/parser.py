@@ -32,6 +32,11 @@ TASK_KEYWORDS = (
     "проработать",
 )
 
+# одна проверка вместо прохода по каждому слову;
+# задачный глагол — в начале текста или после пробела
+_EVENT_KW_RE = re.compile("|".join(map(re.escape, EVENT_KEYWORDS)))
+_TASK_KW_RE = re.compile(r"(?:^| )(?:" + "|".join(map(re.escape, TASK_KEYWORDS)) + r")")
+
 DOW_MAP_EVENT = {
     "понедельник": 0, "пн": 0,
     "вторник": 1, "вт": 1,
@@ -59,6 +64,7 @@ PART_OF_DAY = {
     "вечером": time(19, 0),
     "ночью": time(23, 0),
 }
+_PART_RE = re.compile("|".join(map(re.escape, PART_OF_DAY)))
 
 # --- Регексы ---
 
@@ -82,6 +88,38 @@ DURATION_MINS_ONLY_PATTERN = re.compile(
     r"(?P<mins>\d+)\s*(минут(?:ы|а)?|мин)\b",
     re.IGNORECASE,
 )
+# без этих подстрок ни один из паттернов длительности не сработает
+_DURATION_HINTS = ("на", "прод", "длительн")
+
+# явная длительность события для handle_input: "на 2 часа", "на 90 минут";
+# длинные формы раньше коротких — меньше откатов
+EXPLICIT_DURATION_PATTERN = re.compile(
+    r"\bна\s+(\d+)\s*(минут|мин|часов|часа|час)\b",
+    re.IGNORECASE,
+)
+
+_REL_RE = re.compile(
+    r"через\s+(\d+)\s*(минут[уы]?|мин|час[аов]?|ч|дн[еяь]|день|дней|недел[юи])"
+)
+
+_DOW_EVENT_ALT = (
+    r"(понедельник|вторник|сред[ау]|четверг|пятниц[ау]|"
+    r"суббот[уы]|воскресенье|пн|вт|ср|чт|пт|сб|вс)\b"
+)
+_DOW_IN_RE = re.compile(r"\bво?\s+" + _DOW_EVENT_ALT)
+_DOW_START_RE = re.compile(r"^" + _DOW_EVENT_ALT)
+
+# есть ли в тексте хоть что-то, за что может зацепиться parse_absolute:
+# цифры (дата/время), сегодня/завтра, день недели или часть дня
+_HAS_TEMPORAL_RE = re.compile(
+    r"\d|завтра|сегодня|" + _DOW_EVENT_ALT + "|" + "|".join(map(re.escape, PART_OF_DAY))
+)
+
+_DUE_DOW_RE = re.compile(
+    r"до\s+(понедельника|вторника|среды|четверга|пятницы|"
+    r"субботы|воскресенья|пн|вт|ср|чт|пт|сб|вс)"
+)
+_DUE_DATE_RE = re.compile(r"до\s+(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?")
 
 
 # --- Вспомогательные ---
@@ -97,8 +135,15 @@ def _strip_spaces(s: str) -> str:
     return " ".join(s.split())
 
 
+def _has_trailing_v(s: str) -> bool:
+    # висящее 'в' в конце — то же, что r"\bв$", но без регекса
+    return s.endswith("в") and (len(s) == 1 or not (s[-2].isalnum() or s[-2] == "_"))
+
+
 def _remove_trailing_v(s: str) -> str:
-    return re.sub(r"\bв$", "", s).strip(" ,.-")
+    if _has_trailing_v(s):
+        s = s[:-1]
+    return s.strip(" ,.-")
 
 
 # --- Парсинг длительности ---
@@ -112,33 +157,39 @@ def parse_duration(text: str) -> Tuple[Optional[timedelta], str]:
       - "длительность 2 часа"
     Возвращаем (timedelta | None, текст без этого фрагмента).
     """
-    s = text
+    found = _search_duration(text)
+    if not found:
+        return None, text
+    dur, start, end = found
+    return dur, _cut_span(text, start, end)
+
 
+def _search_duration(s: str) -> Optional[Tuple[timedelta, int, int]]:
+    """
+    (длительность, начало, конец фрагмента) или None.
+    """
     m = DURATION_PATTERN.search(s)
     if m:
         hours = int(m.group("hours"))
         mins = int(m.group("mins") or 0)
-        dur = timedelta(hours=hours, minutes=mins)
-        s = (s[:m.start()] + s[m.end():]).strip(" ,.-")
-        return dur, _strip_spaces(s)
+        return timedelta(hours=hours, minutes=mins), m.start(), m.end()
 
     m2 = DURATION_MINS_ONLY_PATTERN.search(s)
     if m2:
-        mins = int(m2.group("mins"))
-        dur = timedelta(minutes=mins)
-        s = (s[:m2.start()] + s[m2.end():]).strip(" ,.-")
-        return dur, _strip_spaces(s)
+        return timedelta(minutes=int(m2.group("mins"))), m2.start(), m2.end()
+
+    return None
 
-    return None, text
+
+def _cut_span(s: str, start: int, end: int) -> str:
+    return _strip_spaces((s[:start] + s[end:]).strip(" ,.-"))
 
 
 # --- Парсинг относительных интервалов ---
 
-def parse_relative(text: str, now: datetime) -> Tuple[Optional[datetime], Optional[datetime]]:
-    m = re.search(
-        r"через\s+(\d+)\s*(минут[уы]?|мин|час[аов]?|ч|дн[еяь]|день|дней|недел[юи])",
-        text.lower(),
-    )
+def parse_relative(t: str, now: datetime) -> Tuple[Optional[datetime], Optional[datetime]]:
+    # t — уже в нижнем регистре
+    m = _REL_RE.search(t)
     if not m:
         return None, None
 
@@ -162,8 +213,11 @@ def parse_relative(text: str, now: datetime) -> Tuple[Optional[datetime], Option
 
 # --- Парсинг абсолютных дат/времени для событий ---
 
-def parse_absolute(text: str, now: datetime) -> Tuple[Optional[datetime], Optional[datetime]]:
-    t = text.lower()
+def parse_absolute(t: str, now: datetime) -> Tuple[Optional[datetime], Optional[datetime]]:
+    # t — уже в нижнем регистре
+    if not _HAS_TEMPORAL_RE.search(t):
+        return None, None
+
     base_date = now.date()
     date = base_date
     date_set = False
@@ -179,11 +233,7 @@ def parse_absolute(text: str, now: datetime) -> Tuple[Optional[datetime], Option
         date_set = True
 
     # "в/во понедельник ..."
-    m_dow_in = re.search(
-        r"\bво?\s+(понедельник|вторник|сред[ау]|четверг|пятниц[ау]|"
-        r"суббот[уы]|воскресенье|пн|вт|ср|чт|пт|сб|вс)\b",
-        t,
-    )
+    m_dow_in = _DOW_IN_RE.search(t)
     if m_dow_in:
         wd = DOW_MAP_EVENT.get(m_dow_in.group(1))
         if wd is not None:
@@ -192,11 +242,7 @@ def parse_absolute(text: str, now: datetime) -> Tuple[Optional[datetime], Option
             date_set = True
 
     # "Понедельник ..." в начале
-    m_dow_start = re.match(
-        r"^(понедельник|вторник|сред[ау]|четверг|пятниц[ау]|"
-        r"суббот[уы]|воскресенье|пн|вт|ср|чт|пт|сб|вс)\b",
-        t,
-    )
+    m_dow_start = _DOW_START_RE.match(t)
     if m_dow_start:
         wd = DOW_MAP_EVENT.get(m_dow_start.group(1))
         if wd is not None:
@@ -226,11 +272,8 @@ def parse_absolute(text: str, now: datetime) -> Tuple[Optional[datetime], Option
     m_time = TIME_REGEX.search(t)
 
     # часть дня
-    part_time = None
-    for key, pt in PART_OF_DAY.items():
-        if key in t:
-            part_time = pt
-            break
+    m_part = _PART_RE.search(t)
+    part_time = PART_OF_DAY[m_part.group(0)] if m_part else None
 
     if m_time:
         hour = int(m_time.group(1))
@@ -252,27 +295,27 @@ def parse_absolute(text: str, now: datetime) -> Tuple[Optional[datetime], Option
     return None, None
 
 
+def _parse_datetime_lower(t: str, now: datetime) -> Tuple[Optional[datetime], Optional[datetime]]:
+    start, end = parse_relative(t, now)
+    if start:
+        return start, end
+    return parse_absolute(t, now)
+
+
 def parse_datetime(text: str, now: Optional[datetime] = None) -> Tuple[Optional[datetime], Optional[datetime]]:
     if now is None:
         now = datetime.now()
-    start, end = parse_relative(text, now)
-    if start:
-        return start, end
-    return parse_absolute(text, now)
+    return _parse_datetime_lower(text.lower(), now)
 
 
 # --- Парсинг дедлайнов задач ---
 
-def parse_due(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+def parse_due(t: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    # t — уже в нижнем регистре
     if now is None:
         now = datetime.now()
-    t = text.lower()
 
-    m_dow = re.search(
-        r"до\s+(понедельника|вторника|среды|четверга|пятницы|"
-        r"субботы|воскресенья|пн|вт|ср|чт|пт|сб|вс)",
-        t,
-    )
+    m_dow = _DUE_DOW_RE.search(t)
     if m_dow:
         wd = DOW_MAP_DUE.get(m_dow.group(1))
         if wd is not None:
@@ -282,7 +325,7 @@ def parse_due(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
             )
             return dt
 
-    m_date = re.search(r"до\s+(\d{1,2})[./](\d{1,2})(?:[./](\d{2,4}))?", t)
+    m_date = _DUE_DATE_RE.search(t)
     if m_date:
         day = int(m_date.group(1))
         month = int(m_date.group(2))
@@ -317,11 +360,19 @@ def split_title_desc(text: str) -> Tuple[str, str]:
     if not text:
         return "Без названия", ""
 
+    title, desc = _split_first_line(text)
+    _, title_clean = parse_duration(title)
+    return _finish_title(title_clean), desc
+
+
+def _split_first_line(text: str) -> Tuple[str, str]:
     parts = text.split("\n", 1)
     title = parts[0].strip()
     desc = parts[1].strip() if len(parts) > 1 else ""
+    return title, desc
 
-    _, title_clean = parse_duration(title)
+
+def _finish_title(title_clean: str) -> str:
     title_clean = _remove_trailing_v(_strip_spaces(title_clean))
 
     if not title_clean:
@@ -330,18 +381,13 @@ def split_title_desc(text: str) -> Tuple[str, str]:
     if len(title_clean) > 120:
         title_clean = title_clean[:117].rstrip() + "..."
 
-    return title_clean, desc
+    return title_clean
 
 
 # --- Доп. дедлайн по дню недели для задач ---
 
-def _extract_task_weekday_due(text: str, now: datetime) -> Optional[datetime]:
-    t = text.lower()
-    m = re.search(
-        r"\bво?\s+(понедельник|вторник|сред[ау]|четверг|пятниц[ау]|"
-        r"суббот[уы]|воскресенье|пн|вт|ср|чт|пт|сб|вс)\b",
-        t,
-    )
+def _extract_task_weekday_due(t: str, now: datetime) -> Optional[datetime]:
+    m = _DOW_IN_RE.search(t)
     if not m:
         return None
     wd = DOW_MAP_EVENT.get(m.group(1))
@@ -376,20 +422,37 @@ def classify(
         return "note", None, None, None
 
     t = raw.lower()
+    item_type, start_dt, end_dt, due_dt = _classify_lower(t, now)
+
+    # длительность только для событий
+    if item_type == "event" and start_dt and any(h in t for h in _DURATION_HINTS):
+        dur, _ = parse_duration(raw)
+        if dur:
+            end_dt = start_dt + dur
 
+    return item_type, start_dt, end_dt, due_dt
+
+
+def _classify_lower(
+    t: str,
+    now: datetime,
+) -> Tuple[ItemType, Optional[datetime], Optional[datetime], Optional[datetime]]:
+    """
+    classify по тексту в нижнем регистре, без учёта длительности.
+    """
     # базовый слот как раньше
-    start_dt, end_dt = parse_datetime(raw, now)
+    start_dt, end_dt = _parse_datetime_lower(t, now)
 
     # ключевые слова
-    is_event_kw = any(k in t for k in EVENT_KEYWORDS)
-    is_task_kw = any(t.startswith(k) or f" {k}" in t for k in TASK_KEYWORDS)
+    is_event_kw = _EVENT_KW_RE.search(t) is not None
+    is_task_kw = _TASK_KW_RE.search(t) is not None
 
     # дедлайны
-    due_dt = parse_due(raw, now)
+    due_dt = parse_due(t, now)
 
     # задачный глагол + день недели → дедлайн
     if is_task_kw and due_dt is None:
-        extra_due = _extract_task_weekday_due(raw, now)
+        extra_due = _extract_task_weekday_due(t, now)
         if extra_due:
             due_dt = extra_due
 
@@ -401,10 +464,65 @@ def classify(
     else:
         item_type = "note"
 
-    # длительность только для событий
-    if item_type == "event" and start_dt:
-        dur, _ = parse_duration(raw)
-        if dur:
-            end_dt = start_dt + dur
-
     return item_type, start_dt, end_dt, due_dt
+
+
+# --- Всё сразу для service.handle_input ---
+
+def _explicit_duration_minutes(text: str) -> int:
+    """
+    'на 2 часа', 'на 1 час', 'на 90 минут' -> минуты.
+    Если не нашли — 0.
+    """
+    m = EXPLICIT_DURATION_PATTERN.search(text)
+    if not m:
+        return 0
+    n = int(m.group(1))
+    unit = m.group(2).lower()  # регистр текста сохранён — приводим только единицу
+    if unit.startswith("мин"):
+        return n
+    return n * 60
+
+
+def parse_all(
+    text: str,
+    now: Optional[datetime] = None,
+) -> Tuple[ItemType, Optional[datetime], Optional[datetime], Optional[datetime], str, str, int]:
+    """
+    То же, что classify + split_title_desc + явная длительность, но за один проход:
+    (type, start_dt, end_dt, due_dt, title, desc, explicit_duration_min).
+    Текст приводим к нижнему регистру один раз, длительность ищем один раз
+    и по найденному фрагменту и считаем end_dt, и чистим заголовок.
+    explicit_duration_min считаем только для события без слота — иначе
+    у него уже есть end_dt и service она не нужна.
+    """
+    if now is None:
+        now = datetime.now()
+
+    raw = text.strip()
+    if not raw:
+        return "note", None, None, None, "Без названия", "", 0
+
+    t = raw.lower()
+    item_type, start_dt, end_dt, due_dt = _classify_lower(t, now)
+
+    found = _search_duration(raw) if any(h in t for h in _DURATION_HINTS) else None
+
+    if item_type == "event" and start_dt and found:
+        end_dt = start_dt + found[0]
+
+    title, desc = _split_first_line(raw)
+    if found is None:
+        # во всём тексте длительности нет — значит, нет и в заголовке
+        title_clean = title
+    elif found[2] <= len(title):
+        # найденный фрагмент целиком в первой строке — тот же, что нашёл бы поиск по ней
+        title_clean = _cut_span(title, found[1], found[2])
+    else:
+        title_clean = parse_duration(title)[1]
+
+    explicit_dur = 0
+    if item_type == "event" and start_dt is None and "на" in t:
+        explicit_dur = _explicit_duration_minutes(raw)
+
+    return item_type, start_dt, end_dt, due_dt, _finish_title(title_clean), desc, explicit_dur
@@ -1,61 +1,37 @@
-import re
+import sqlite3
 from datetime import datetime, timedelta
 from typing import Tuple, Optional
 
 from .models import Item
 from . import storage
-from .parser import classify, split_title_desc
+from .parser import parse_all
 
 
-def init():
-    storage.init_db()
+# user_id -> число активных событий; None — init() ещё не вызывался.
+# Нулевой счётчик позволяет не ходить в БД за проверкой конфликта.
+_event_counts: Optional[dict[str, int]] = None
 
 
-def _load_user_events(user_id: str):
-    conn = storage.get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, title, start_at, end_at
-        FROM items
-        WHERE user_id = ?
-          AND type = 'event'
-          AND status = 'active'
-          AND start_at IS NOT NULL
-        """,
-        (str(user_id),),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+# форматирование дат без strftime (формат фиксированный, локаль не нужна)
+def _fmt_date(dt: datetime) -> str:
+    return f"{dt.day:02d}.{dt.month:02d}.{dt.year:04d}"
 
 
-def _parse_interval(start_str: str, end_str: Optional[str]):
-    """
-    Превращаем (start_at, end_at) в:
-    - ("point", S, S) если нет нормальной длительности;
-    - ("interval", S, E) если E > S.
-    """
-    try:
-        s = datetime.fromisoformat(start_str)
-    except Exception:
-        return None
-
-    e = None
-    if end_str:
-        try:
-            e = datetime.fromisoformat(end_str)
-            if e <= s:
-                e = None
-        except Exception:
-            e = None
-
-    if e is None:
-        return ("point", s, s)
-    return ("interval", s, e)
-
-
-def _find_event_conflict(user_id: str, new_start: datetime, new_end: Optional[datetime]) -> Optional[tuple]:
+def _fmt_time(dt: datetime) -> str:
+    return f"{dt.hour:02d}:{dt.minute:02d}"
+
+
+def _fmt_dt(dt: datetime) -> str:
+    return f"{_fmt_date(dt)} {_fmt_time(dt)}"
+
+
+def init():
+    global _event_counts
+    storage.init_db()
+    _event_counts = storage.get_active_event_counts()
+
+
+def _find_event_conflict(user_id: str, new_start: datetime, new_end: Optional[datetime]) -> Optional[sqlite3.Row]:
     """
     Проверяем пересечение нового события с существующими.
 
@@ -68,54 +44,34 @@ def _find_event_conflict(user_id: str, new_start: datetime, new_end: Optional[da
         - точкой внутри него;
         - интервалом, который с ним пересекается;
     - [12:00-14:00] и [14:00-...] не конфликтуют.
-    """
-    rows = _load_user_events(user_id)
 
-    if new_end and new_end > new_start:
-        new_type = "interval"
-    else:
-        new_type = "point"
-        new_end = new_start
-
-    for item_id, title, s_str, e_str in rows:
-        parsed = _parse_interval(s_str, e_str)
-        if not parsed:
-            continue
-        ex_type, ex_start, ex_end = parsed
-
-        if new_type == "point" and ex_type == "point":
-            if new_start == ex_start:
-                return item_id, title, s_str, e_str
-
-        elif new_type == "point" and ex_type == "interval":
-            if ex_start <= new_start < ex_end:
-                return item_id, title, s_str, e_str
-
-        elif new_type == "interval" and ex_type == "point":
-            if new_start <= ex_start < new_end:
-                return item_id, title, s_str, e_str
-
-        else:  # оба интервалы
-            if not (new_end <= ex_start or ex_end <= new_start):
-                return item_id, title, s_str, e_str
-
-    return None
-
-
-def _extract_explicit_duration_minutes(text: str) -> int:
-    """
-    'на 2 часа', 'на 1 час', 'на 90 минут' -> минуты.
-    Если не нашли — 0.
+    Всё это — одно условие полуоткрытых интервалов [start, end),
+    где у точки end = start + 1 мкс. Проверяет SQLite по индексу.
     """
-    t = text.lower()
-    m = re.search(r"\bна\s+(\d+)\s*(минут|мин|час|часа|часов)\b", t)
-    if not m:
-        return 0
-    n = int(m.group(1))
-    unit = m.group(2)
-    if unit.startswith("мин"):
-        return n
-    return n * 60
+    # в БД время лежит с точностью до секунд — сравниваем так же
+    new_start = new_start.replace(microsecond=0)
+    if new_end:
+        new_end = new_end.replace(microsecond=0)
+    if not (new_end and new_end > new_start):
+        new_end = new_start + timedelta(microseconds=1)
+
+    conn = storage.get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT title, start_at, end_at
+        FROM items
+        WHERE user_id = ?
+          AND type = 'event'
+          AND status = 'active'
+          AND start_at IS NOT NULL
+          AND start_at < ?
+          AND CASE WHEN end_at > start_at THEN end_at > ? ELSE start_at >= ? END
+        LIMIT 1
+        """,
+        (str(user_id), new_end.isoformat(), new_start.isoformat(), new_start.isoformat()),
+    )
+    return cur.fetchone()
 
 
 def handle_input(user_id: str, text: str) -> Tuple[str, Optional[Item]]:
@@ -125,8 +81,7 @@ def handle_input(user_id: str, text: str) -> Tuple[str, Optional[Item]]:
       - нормальный текст + Item при успехе;
       - "__CONFLICT__|..." и None при конфликте слота.
     """
-    item_type, start_dt, end_dt, due_dt = classify(text)
-    title, desc = split_title_desc(text)
+    item_type, start_dt, end_dt, due_dt, title, desc, explicit_dur = parse_all(text)
     uid = str(user_id)
 
     # --- Событие ---
@@ -136,12 +91,10 @@ def handle_input(user_id: str, text: str) -> Tuple[str, Optional[Item]]:
             base = datetime.now().date() + timedelta(days=1)
             start_dt = datetime.combine(base, datetime.min.time()).replace(hour=10, minute=0)
 
-        # Явная длительность из текста (если есть).
-        explicit_dur = _extract_explicit_duration_minutes(text)
-
         # Если end_dt пришёл из парсера и валиден — используем его.
         if end_dt and end_dt > start_dt:
-            duration_min = int((end_dt - start_dt).total_seconds() // 60)
+            delta = end_dt - start_dt
+            duration_min = delta.days * 1440 + delta.seconds // 60
         else:
             # Если есть явная длительность — считаем end_dt.
             if explicit_dur > 0:
@@ -152,30 +105,24 @@ def handle_input(user_id: str, text: str) -> Tuple[str, Optional[Item]]:
                 duration_min = 0
                 end_dt = None
 
-        # Проверка конфликта
-        conflict = _find_event_conflict(uid, start_dt, end_dt)
+        # Проверка конфликта (у пользователя без событий конфликтовать не с чем)
+        if _event_counts is not None and not _event_counts.get(uid):
+            conflict = None
+        else:
+            conflict = _find_event_conflict(uid, start_dt, end_dt)
         if conflict:
-            _cid, ctitle, cstart, cend = conflict
-            try:
-                cs = datetime.fromisoformat(cstart)
-                # для вывода конца берём как есть, если был
-                ce = datetime.fromisoformat(cend) if cend else cs
-                # __CONFLICT__|day|conf_title|conf_start|conf_end|new_title|duration_min
-                payload = (
-                    "__CONFLICT__|"
-                    f"{start_dt.date().isoformat()}|"
-                    f"{ctitle}|"
-                    f"{cs.isoformat()}|"
-                    f"{ce.isoformat()}|"
-                    f"{title}|"
-                    f"{duration_min}"
-                )
-            except Exception:
-                payload = (
-                    "__CONFLICT__|"
-                    f"{start_dt.date().isoformat()}|||"
-                    f"|{title}|{duration_min}"
-                )
+            ctitle, cstart, cend = conflict["title"], conflict["start_at"], conflict["end_at"]
+            # в БД уже ISO-строки — кладём как есть; конец берём, если был
+            # __CONFLICT__|day|conf_title|conf_start|conf_end|new_title|duration_min
+            payload = (
+                "__CONFLICT__|"
+                f"{start_dt.date().isoformat()}|"
+                f"{ctitle}|"
+                f"{cstart}|"
+                f"{cend or cstart}|"
+                f"{title}|"
+                f"{duration_min}"
+            )
             return payload, None
 
         # Создаём событие
@@ -188,11 +135,13 @@ def handle_input(user_id: str, text: str) -> Tuple[str, Optional[Item]]:
             end_at=end_dt,
         )
         item = storage.insert_item(item)
+        if _event_counts is not None:
+            _event_counts[uid] = _event_counts.get(uid, 0) + 1
 
         if end_dt:
-            times = f"{start_dt.strftime('%d.%m.%Y %H:%M')} - {end_dt.strftime('%H:%M')}"
+            times = f"{_fmt_dt(start_dt)} - {_fmt_time(end_dt)}"
         else:
-            times = f"{start_dt.strftime('%d.%m.%Y %H:%M')}"
+            times = _fmt_dt(start_dt)
         return f"Добавил событие: {title}\n{times}", item
 
     # --- Задача ---
@@ -207,7 +156,7 @@ def handle_input(user_id: str, text: str) -> Tuple[str, Optional[Item]]:
         item = storage.insert_item(item)
 
         if due_dt:
-            return f"Добавил задачу: {title} (к {due_dt.strftime('%d.%m.%Y')})", item
+            return f"Добавил задачу: {title} (к {_fmt_date(due_dt)})", item
         return f"Добавил задачу: {title}", item
 
     # --- Заметка ---
@@ -1,6 +1,7 @@
 import os
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+from datetime import date, datetime, timedelta
 from typing import List, Tuple, Optional
 from pathlib import Path
 
@@ -13,8 +14,45 @@ if not DB_PATH.is_absolute():
     DB_PATH = ROOT_DIR / DB_PATH
 
 
-def get_conn():
-    return sqlite3.connect(DB_PATH)
+def _adapt_datetime(dt: datetime) -> str:
+    # всегда YYYY-MM-DDTHH:MM:SS: строки одной длины сравниваются и режутся как числа
+    return dt.isoformat(timespec="seconds")
+
+
+# datetime можно передавать в запросы как есть (None sqlite3 и так пишет как NULL)
+sqlite3.register_adapter(datetime, _adapt_datetime)
+
+
+# одно соединение на процесс: открываем лениво, PRAGMA выполняем один раз
+_CONN: Optional[sqlite3.Connection] = None
+# записи из разных потоков (если появятся) не должны перемешиваться в одной транзакции
+_WRITE_LOCK = threading.Lock()
+
+
+def get_conn() -> sqlite3.Connection:
+    global _CONN
+    if _CONN is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # строки доступны и по имени колонки, и как кортеж (распаковка не ломается)
+        conn.row_factory = sqlite3.Row
+        _CONN = conn
+    return _CONN
+
+
+def reset_conn() -> None:
+    """
+    Закрыть общее соединение (после ошибки БД); следующий get_conn откроет новое.
+    """
+    global _CONN
+    if _CONN is not None:
+        try:
+            _CONN.close()
+        except sqlite3.Error:
+            pass
+        _CONN = None
 
 
 def init_db():
@@ -37,73 +75,124 @@ def init_db():
         );
         """
     )
-    conn.commit()
-    conn.close()
-
-
-def insert_item(item: Item) -> Item:
-    conn = get_conn()
-    cur = conn.cursor()
+    # частичные индексы под выборки reminder_loop: только ещё не напомненные записи
     cur.execute(
         """
-        INSERT INTO items (user_id, title, description, type, start_at, end_at, due_at, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            item.user_id,
-            item.title,
-            item.description,
-            item.type,
-            item.start_at.isoformat() if item.start_at else None,
-            item.end_at.isoformat() if item.end_at else None,
-            item.due_at.isoformat() if item.due_at else None,
-            item.status,
-        ),
+        CREATE INDEX IF NOT EXISTS idx_events_pending ON items(start_at)
+        WHERE type = 'event' AND status = 'active' AND event_notified = 0
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_tasks_pending ON items(due_at)
+        WHERE type = 'task' AND status = 'active' AND due_notified = 0
+        """
+    )
+    # события пользователя по началу: план на день/период и поиск пересечений
+    # (status не в ключе — выборки событий на день его не фильтруют)
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_items_today
+        ON items(user_id, type, start_at)
+        """
+    )
+    # активные задачи пользователя в порядке дедлайна: /tasks без сортировки во временном B-дереве
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_items_tasks
+        ON items(user_id, type, status, due_at, id)
+        """
+    )
+    # /notes целиком из индекса: без чтения строк таблицы и без сортировки
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_items_notes
+        ON items(user_id, type, id DESC, title)
+        """
+    )
+    # когда пользователю последний раз ушла утренняя сводка (переживает рестарт)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_digest_sent (
+            user_id TEXT PRIMARY KEY,
+            last_date TEXT NOT NULL
+        );
+        """
     )
-    item.id = cur.lastrowid
     conn.commit()
-    conn.close()
-    return item
+
+
+INSERT_ITEM_SQL = """
+    INSERT INTO items (user_id, title, description, type, start_at, end_at, due_at, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def insert_items(items: List[Item]) -> List[Item]:
+    """
+    Вставляем пачку записей одной транзакцией (один commit на всю пачку).
+    id проставляем каждой из lastrowid своего INSERT.
+    """
+    conn = get_conn()
+    with _WRITE_LOCK, conn:
+        for item in items:
+            cur = conn.execute(
+                INSERT_ITEM_SQL,
+                (
+                    item.user_id,
+                    item.title,
+                    item.description,
+                    item.type,
+                    item.start_at,
+                    item.end_at,
+                    item.due_at,
+                    item.status,
+                ),
+            )
+            item.id = cur.lastrowid
+    return items
+
+
+def insert_item(item: Item) -> Item:
+    return insert_items([item])[0]
 
 
 def get_today_items(user_id: str):
-    now = datetime.now()
-    today = now.date()
-    tomorrow = today + timedelta(days=1)
+    today = datetime.now().date()
+    today_iso = today.isoformat()
+    tomorrow_iso = (today + timedelta(days=1)).isoformat()
 
     conn = get_conn()
     cur = conn.cursor()
 
-    # события
+    # события и задачи одним запросом; k различает, откуда строка
     cur.execute(
         """
-        SELECT title, start_at, end_at FROM items
+        SELECT 'e' AS k, title, start_at AS at, end_at FROM items
         WHERE user_id = ?
           AND type = 'event'
           AND start_at IS NOT NULL
           AND start_at >= ?
           AND start_at < ?
-        ORDER BY start_at
-        """,
-        (user_id, today.isoformat(), tomorrow.isoformat()),
-    )
-    events = cur.fetchall()
-
-    # задачи
-    cur.execute(
-        """
-        SELECT title, due_at FROM items
+        UNION ALL
+        SELECT 't', title, due_at, NULL FROM items
         WHERE user_id = ?
           AND type = 'task'
           AND status = 'active'
           AND (due_at IS NULL OR due_at <= ?)
-        ORDER BY COALESCE(due_at, ?)
+        ORDER BY k, at NULLS LAST
         """,
-        (user_id, tomorrow.isoformat(), tomorrow.isoformat()),
+        (user_id, today_iso, tomorrow_iso, user_id, tomorrow_iso),
     )
-    tasks = cur.fetchall()
 
-    conn.close()
+    events = []
+    tasks = []
+    for k, title, at, end_at in cur.fetchall():
+        if k == "e":
+            events.append((title, at, end_at))
+        else:
+            tasks.append((title, at))
+
     return events, tasks
 
 
@@ -116,13 +205,12 @@ def get_tasks(user_id: str, limit: int = 30):
         WHERE user_id = ?
           AND type = 'task'
           AND status = 'active'
-        ORDER BY COALESCE(due_at, '9999-12-31') ASC, id ASC
+        ORDER BY due_at NULLS LAST, id
         LIMIT ?
         """,
         (user_id, limit),
     )
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 
@@ -140,55 +228,75 @@ def get_notes(user_id: str, limit: int = 30):
         (user_id, limit),
     )
     rows = cur.fetchall()
-    conn.close()
     return rows
 
 
-def get_due_events_and_tasks(now: datetime, event_window_min: int, task_window_min: int):
+def get_all_user_ids():
     """
-    Старый вспомогательный метод.
-    Сейчас reminder_loop в telegram_bot.py делает выборки напрямую.
-    Оставлен для совместимости, если где-то ещё используется.
+    Используется для утреннего дайджеста:
+    получить список всех пользователей, у кого есть записи.
     """
     conn = get_conn()
     cur = conn.cursor()
+    cur.execute("SELECT DISTINCT user_id FROM items")
+    rows = [row[0] for row in cur.fetchall()]
+    return rows
 
-    cur.execute(
-        """
-        SELECT id, user_id, title, start_at
-        FROM items
-        WHERE type = 'event'
-          AND status = 'active'
-          AND start_at IS NOT NULL
-          AND event_notified = 0
-        """
-    )
-    events = cur.fetchall()
 
+def get_active_event_counts() -> dict[str, int]:
+    """
+    user_id -> число активных событий (для быстрого пропуска проверки конфликтов).
+    """
+    conn = get_conn()
+    cur = conn.cursor()
     cur.execute(
         """
-        SELECT id, user_id, title, due_at
-        FROM items
-        WHERE type = 'task'
-          AND status = 'active'
-          AND due_at IS NOT NULL
-          AND due_notified = 0
+        SELECT user_id, COUNT(*) FROM items
+        WHERE type = 'event' AND status = 'active'
+        GROUP BY user_id
         """
     )
-    tasks = cur.fetchall()
-
-    conn.close()
-    return events, tasks
+    return {row[0]: row[1] for row in cur.fetchall()}
 
 
-def get_all_user_ids():
+def get_digest_sent_user_ids(day: date) -> set[str]:
     """
-    Используется для утреннего дайджеста:
-    получить список всех пользователей, у кого есть записи.
+    Пользователи, которым сводка за day уже отправлена.
     """
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT DISTINCT user_id FROM items")
-    rows = [row[0] for row in cur.fetchall()]
-    conn.close()
+    cur.execute(
+        "SELECT user_id FROM user_digest_sent WHERE last_date = ?",
+        (day.isoformat(),),
+    )
+    rows = {row[0] for row in cur.fetchall()}
     return rows
+
+
+def mark_digest_sent(user_id: str, day: date) -> None:
+    conn = get_conn()
+    with _WRITE_LOCK, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO user_digest_sent (user_id, last_date) VALUES (?, ?)",
+            (user_id, day.isoformat()),
+        )
+
+
+def _mark_notified(column: str, item_ids: List[int]) -> None:
+    if not item_ids:
+        return
+    placeholders = ",".join("?" * len(item_ids))
+    conn = get_conn()
+    with _WRITE_LOCK, conn:
+        conn.execute(
+            f"UPDATE items SET {column} = 1 WHERE id IN ({placeholders})",
+            item_ids,
+        )
+
+
+def mark_events_notified(item_ids: List[int]) -> None:
+    _mark_notified("event_notified", item_ids)
+
+
+def mark_tasks_notified(item_ids: List[int]) -> None:
+    _mark_notified("due_notified", item_ids)